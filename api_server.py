@@ -1,7 +1,11 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import threading
+import json
+import asyncio
+import anyio
 import shutil
 import os
 import uvicorn
@@ -10,6 +14,10 @@ from typing import Optional
 # 复用现有项目逻辑（不修改原文件）
 from qa_chain import VegetablePriceChatbot
 from vector_db import init_vector_db
+from embeddings import LLM_MODEL
+
+# 价格数据文件：向量库与精确查询索引须使用同一份数据
+CSV_PATH = "cabbage_prices.csv"
 
 
 class ChatRequest(BaseModel):
@@ -26,6 +34,9 @@ class HealthResponse(BaseModel):
     status: str
     vectors: int
     model: str
+    cache_hits: int = 0
+    cache_misses: int = 0
+    cache_hit_rate: float = 0.0
 
 
 class ApiServerState:
@@ -37,7 +48,7 @@ class ApiServerState:
         if cls._bot is None:
             with cls._lock:
                 if cls._bot is None:
-                    cls._bot = VegetablePriceChatbot()
+                    cls._bot = VegetablePriceChatbot(csv_path=CSV_PATH)
         return cls._bot
 
     @classmethod
@@ -46,6 +57,11 @@ class ApiServerState:
             cls._bot = None
 
 
+# 同时进行中的LLM请求上限，按智谱QPS限额调整
+MAX_CONCURRENCY = 16
+_llm_semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+
 app = FastAPI(title="Cabbage Price QA API", version="1.0.0")
 
 # CORS，可按需限制到你的前端主机
@@ -66,21 +82,27 @@ def health_check():
             vector_count = bot.db._collection.count()
         except Exception:
             vector_count = 0
+        cache_stats = bot.semantic_cache.stats()
         return HealthResponse(
             status="ok",
             vectors=vector_count,
-            model="glm-z1-flash",
+            model=LLM_MODEL,
+            cache_hits=cache_stats["hits"],
+            cache_misses=cache_stats["misses"],
+            cache_hit_rate=cache_stats["hit_rate"],
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
+async def chat(req: ChatRequest):
     if not req.question or not req.question.strip():
         raise HTTPException(status_code=400, detail="问题不能为空")
-    bot = ApiServerState.get_bot()
-    result = bot.chat(req.question)
+    # 首次加载Bot涉及磁盘与网络IO，放到线程中执行
+    bot = await anyio.to_thread.run_sync(ApiServerState.get_bot)
+    async with _llm_semaphore:
+        result = await bot.achat(req.question)
     if isinstance(result, dict):
         if "error" in result:
             raise HTTPException(status_code=500, detail=result["error"])
@@ -93,6 +115,24 @@ def chat(req: ChatRequest):
     return ChatResponse(answer=str(result), sources=[], retrieved_count=0)
 
 
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest):
+    """
+    流式问答：以 SSE（text/event-stream）逐段推送检索数据源与回答片段，最后发送 [DONE]。
+    """
+    if not req.question or not req.question.strip():
+        raise HTTPException(status_code=400, detail="问题不能为空")
+    bot = await anyio.to_thread.run_sync(ApiServerState.get_bot)
+
+    async def event_stream():
+        async with _llm_semaphore:
+            async for event in bot.astream_chat(req.question):
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @app.post("/rebuild")
 def rebuild_vector_db():
     """
@@ -104,7 +144,7 @@ def rebuild_vector_db():
         if os.path.isdir(persist_dir):
             shutil.rmtree(persist_dir)
         # 重新构建
-        init_vector_db()
+        init_vector_db(CSV_PATH)
         # 重置与重载
         ApiServerState.reset_bot()
         ApiServerState.get_bot()
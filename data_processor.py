@@ -1,69 +1,137 @@
+import csv
+import os
 import pandas as pd
 from langchain_text_splitters import CharacterTextSplitter
 import re
 
+# 省级行政区名称（含“内蒙古”“黑龙江”等三字省份）
+PROVINCES = ["北京", "天津", "上海", "重庆", "河北", "山西", "内蒙古", "辽宁", "吉林", "黑龙江",
+             "江苏", "浙江", "安徽", "福建", "江西", "山东", "河南", "湖北", "湖南", "广东",
+             "广西", "海南", "四川", "贵州", "云南", "西藏", "陕西", "甘肃", "青海", "宁夏", "新疆"]
+
+# 预编译正则，整列提取时复用
+PROVINCE_PATTERN = re.compile("(" + "|".join(PROVINCES) + ")")
+_CITY_PATTERN = re.compile(r"[省市自治区特别行政区]{0,3}([\u4e00-\u9fa5]{2,3})(?:市|州|县|区)")
+_CITY_FALLBACK_PATTERN = re.compile(r"([\u4e00-\u9fa5]{2,3})市")
+_DATE_PATTERN = re.compile(r"^(\d{4})-(\d{2})-(\d{2})")
+
+# 超过该大小的CSV改为逐行流式读取，不再整体载入 DataFrame
+STREAM_THRESHOLD_BYTES = 50 * 1024 * 1024
+
+# 所有列按CSV原文读取为字符串，仅空单元格视为缺失：与 csv.DictReader 流式路径保持一致，
+# 避免 pandas 按列推断数值类型导致同一价格在不同读取路径下格式不同（如“3”与“3.0”）
+_READ_CSV_KWARGS = {"dtype": str, "keep_default_na": False, "na_values": [""]}
+
+# 文本模板所用列（顺序与模板一致）
+_TEXT_COLUMNS = ['品种', '批发市场', '最低价', '最高价', '平均价', '发布日期']
+# 元数据字段（顺序与 build_texts_and_metadatas 中的列数组一致）
+_META_KEYS = ("variety", "market", "avg_price", "min_price", "max_price",
+              "date", "year", "date_md", "province", "city")
+
+# 将每行数据拼接为统一的文本模板：各列先转为 NumPy 数组，再逐行 zip 拼接，避免 apply/iterrows 的逐行分派
+def _format_texts(df):
+    variety, market, min_price, max_price, avg_price, date = (df[c].astype(str).to_numpy() for c in _TEXT_COLUMNS)
+    return [
+        f"品种：{v}，批发市场：{m}，最低价：{lo}元，最高价：{hi}元，平均价：{avg}元，发布日期：{d}"
+        for v, m, lo, hi, avg, d in zip(variety, market, min_price, max_price, avg_price, date)
+    ]
+
 # 加载数据
 def load_cabbage_data(file_path):
-    df = pd.read_csv(file_path)
+    df = pd.read_csv(file_path, **_READ_CSV_KWARGS)
     # 处理部分列存在的空值情况，用“无数据”填充
     df = df.fillna("无数据")
     # 将每行数据转换为文本格式
-    df['text'] = df.apply(lambda row: f"品种：{row['品种']}，批发市场：{row['批发市场']}，最低价：{row['最低价']}元，最高价：{row['最高价']}元，平均价：{row['平均价']}元，发布日期：{row['发布日期']}", axis=1)
+    df['text'] = _format_texts(df)
     return df['text'].tolist()
 
 # 构建文本与元数据（用于精确过滤）
 def build_texts_and_metadatas(file_path):
-    df = pd.read_csv(file_path)
+    df = pd.read_csv(file_path, **_READ_CSV_KWARGS)
     df = df.fillna("无数据")
 
-    def extract_province(market: str) -> str:
-        if not isinstance(market, str) or len(market) < 2:
-            return "未知"
-        # 简化处理：取前两个汉字作为省级区域（如“甘肃”、“北京”、“山东”）
-        return market[:2]
-
-    def extract_city(market: str) -> str:
-        if not isinstance(market, str):
-            return "未知"
-        # 匹配“XX省/自治区/市?XX市/州/县/区”中的市县州等
-        m = re.search(r"[省市自治区特别行政区]{0,3}([\u4e00-\u9fa5]{2,3})(市|州|县|区)", market)
-        if m:
-            return m.group(1)
-        # 兜底：查找“市”前两个字
-        m2 = re.search(r"([\u4e00-\u9fa5]{2,3})市", market)
-        if m2:
-            return m2.group(1)
-        return "未知"
-
-    def split_date(date_str: str):
-        s = str(date_str)
-        # 期望 YYYY-MM-DD，提取年、月、日
-        m = re.match(r"(\d{4})-(\d{2})-(\d{2})", s)
-        if not m:
-            return {"date": s, "year": "未知", "date_md": s}
-        year, month, day = m.group(1), m.group(2), m.group(3)
-        return {"date": s, "year": year, "date_md": f"{month}-{day}"}
-
-    texts = []
-    metadatas = []
-    for _, row in df.iterrows():
-        text = f"品种：{row['品种']}，批发市场：{row['批发市场']}，最低价：{row['最低价']}元，最高价：{row['最高价']}元，平均价：{row['平均价']}元，发布日期：{row['发布日期']}"
-        texts.append(text)
-        date_parts = split_date(row.get('发布日期', '未知'))
-        metadatas.append({
-            "variety": str(row.get('品种', '未知')),
-            "market": str(row.get('批发市场', '未知')),
-            "avg_price": str(row.get('平均价', '未知')),
-            "min_price": str(row.get('最低价', '未知')),
-            "max_price": str(row.get('最高价', '未知')),
-            "date": date_parts["date"],
-            "year": date_parts["year"],
-            "date_md": date_parts["date_md"],
-            "province": extract_province(str(row.get('批发市场', '未知'))),
-            "city": extract_city(str(row.get('批发市场', '未知')))
-        })
+    texts = _format_texts(df)
+
+    market = df['批发市场'].astype(str)
+    date = df['发布日期'].astype(str)
+
+    # 一次扫描匹配全部省份名；未出现省份名时沿用前两个汉字（如“沈阳”）
+    province = market.str.extract(PROVINCE_PATTERN, expand=False)
+    province = province.fillna(market.str[:2].where(market.str.len() >= 2, "未知"))
+
+    # 匹配“XX省/自治区/市?XX市/州/县/区”中的市县州等；兜底查找“市”前两个字
+    city = market.str.extract(_CITY_PATTERN, expand=False)
+    city = city.fillna(market.str.extract(_CITY_FALLBACK_PATTERN, expand=False)).fillna("未知")
+
+    # 期望 YYYY-MM-DD，提取年、月、日；不符合格式时保留原值
+    parts = date.str.extract(_DATE_PATTERN)
+    matched = parts[0].notna()
+    year = parts[0].where(matched, "未知")
+    date_md = (parts[1] + "-" + parts[2]).where(matched, date)
+
+    columns = (
+        df['品种'].astype(str),
+        market,
+        df['平均价'].astype(str),
+        df['最低价'].astype(str),
+        df['最高价'].astype(str),
+        date,
+        year,
+        date_md,
+        province,
+        city,
+    )
+    metadatas = [dict(zip(_META_KEYS, row)) for row in zip(*(col.to_numpy() for col in columns))]
     return texts, metadatas
 
+# 逐行流式读取CSV，逐条生成 (文本, 元数据)；不构建 DataFrame，适用于超大文件
+def iter_texts_and_metadatas(file_path):
+    with open(file_path, encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            # 与 DataFrame 路径一致：空值用“无数据”填充
+            variety = row.get('品种') or "无数据"
+            market = row.get('批发市场') or "无数据"
+            min_price = row.get('最低价') or "无数据"
+            max_price = row.get('最高价') or "无数据"
+            avg_price = row.get('平均价') or "无数据"
+            date = row.get('发布日期') or "无数据"
+
+            text = f"品种：{variety}，批发市场：{market}，最低价：{min_price}元，最高价：{max_price}元，平均价：{avg_price}元，发布日期：{date}"
+
+            if m := PROVINCE_PATTERN.search(market):
+                province = m.group(1)
+            else:
+                province = market[:2] if len(market) >= 2 else "未知"
+
+            m = _CITY_PATTERN.search(market) or _CITY_FALLBACK_PATTERN.search(market)
+            city = m.group(1) if m else "未知"
+
+            if m := _DATE_PATTERN.match(date):
+                year, date_md = m.group(1), f"{m.group(2)}-{m.group(3)}"
+            else:
+                year, date_md = "未知", date
+
+            yield text, {
+                "variety": variety,
+                "market": market,
+                "avg_price": avg_price,
+                "min_price": min_price,
+                "max_price": max_price,
+                "date": date,
+                "year": year,
+                "date_md": date_md,
+                "province": province,
+                "city": city,
+            }
+
+# 逐条产出 (文本, 元数据)：小文件走 DataFrame 向量化路径，大文件逐行流式读取
+def iter_records(file_path):
+    if os.path.getsize(file_path) > STREAM_THRESHOLD_BYTES:
+        yield from iter_texts_and_metadatas(file_path)
+    else:
+        texts, metadatas = build_texts_and_metadatas(file_path)
+        yield from zip(texts, metadatas)
+
 # 分割文本
 def split_texts(texts):
     text_splitter = CharacterTextSplitter(
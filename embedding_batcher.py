@@ -0,0 +1,60 @@
+# embedding_batcher.py
+import asyncio
+
+
+class EmbeddingBatcher:
+    """
+    嵌入请求微批处理：并发请求的问题在短时间窗口内合并为一次 embed_documents 调用，
+    摊薄每次请求的 HTTP 往返开销。
+    """
+
+    def __init__(self, embeddings, max_batch_size: int = 32, max_wait_ms: float = 8):
+        self._embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = None
+        self._worker = None
+        # 持有进行中的发送任务的引用，防止被垃圾回收
+        self._flush_tasks = set()
+
+    # 队列与后台任务需在事件循环内创建，首次提交时再启动
+    def _ensure_started(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def submit(self, text: str) -> list[float]:
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # 每批独立发送，不阻塞下一批的收集
+            task = asyncio.create_task(self._flush(batch))
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush(self, batch):
+        try:
+            vectors = await self._embeddings.aembed_documents([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
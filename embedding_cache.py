@@ -0,0 +1,50 @@
+# embedding_cache.py
+import hashlib
+import sqlite3
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    本地向量缓存：以 (模型, sha256(文本)) 为键保存嵌入结果。
+    同一模型对相同文本的向量是确定的，重建向量库时命中的文本无需再次请求接口。
+    """
+
+    def __init__(self, path: str = "./emb_cache.sqlite"):
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    # 返回与 hashes 对齐的列表，未命中的位置为 None
+    def get_many(self, model: str, hashes: list[str]) -> list:
+        found = {}
+        # 分段查询，避免超过 SQLite 的参数个数上限
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [model, *chunk],
+            )
+            for text_hash, blob in rows:
+                found[text_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return [found.get(h) for h in hashes]
+
+    def put_many(self, model: str, hashes: list[str], vectors: list):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+            [(model, h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in zip(hashes, vectors)],
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
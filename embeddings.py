@@ -0,0 +1,59 @@
+# embeddings.py
+import os
+import threading
+
+import httpx
+from dotenv import load_dotenv
+from langchain_community.chat_models import ChatZhipuAI
+from langchain_community.embeddings import ZhipuAIEmbeddings
+from zhipuai import ZhipuAI
+
+load_dotenv()
+
+EMBEDDING_MODEL = "embedding-2"  # 智谱官方推荐的嵌入模型
+LLM_MODEL = "glm-z1-flash"
+
+# 进程内共享的客户端，避免每次创建时重复建立 TCP/TLS 连接
+_lock = threading.Lock()
+_EMBEDDINGS_SINGLETON = None
+_LLM_SINGLETON = None
+
+
+def _get_api_key() -> str:
+    api_key = os.getenv("ZHIPUAI_API_KEY")
+    if not api_key:
+        raise ValueError("未找到ZHIPUAI_API_KEY，请在.env文件中配置")
+    return api_key
+
+
+def get_embeddings() -> ZhipuAIEmbeddings:
+    global _EMBEDDINGS_SINGLETON
+    if _EMBEDDINGS_SINGLETON is None:
+        with _lock:
+            if _EMBEDDINGS_SINGLETON is None:
+                api_key = _get_api_key()
+                embeddings = ZhipuAIEmbeddings(api_key=api_key, model=EMBEDDING_MODEL)
+                # 换成带连接池的 SDK 客户端，批量导入和并发查询时复用长连接
+                embeddings.client = ZhipuAI(
+                    api_key=api_key,
+                    http_client=httpx.Client(
+                        limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+                        timeout=60,
+                    ),
+                )
+                _EMBEDDINGS_SINGLETON = embeddings
+    return _EMBEDDINGS_SINGLETON
+
+
+def get_chat_llm() -> ChatZhipuAI:
+    global _LLM_SINGLETON
+    if _LLM_SINGLETON is None:
+        with _lock:
+            if _LLM_SINGLETON is None:
+                _LLM_SINGLETON = ChatZhipuAI(
+                    api_key=_get_api_key(),
+                    model_name=LLM_MODEL,
+                    temperature=0.2,
+                    request_timeout=60
+                )
+    return _LLM_SINGLETON
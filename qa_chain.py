@@ -1,50 +1,154 @@
 # qa_chain.py
 from langchain.chains import create_history_aware_retriever, create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.memory import ConversationBufferMemory
-from langchain_community.chat_models import ChatZhipuAI
-from langchain_community.embeddings import ZhipuAIEmbeddings
+from langchain.memory import ConversationBufferWindowMemory
 from langchain_chroma import Chroma
+import functools
 import os
 import time
 from dotenv import load_dotenv
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.documents import Document
+from langchain_core.globals import set_llm_cache
+from langchain_core.caches import InMemoryCache
 import re
+from data_processor import PROVINCE_PATTERN, iter_records
+from embeddings import get_chat_llm, get_embeddings
+from semantic_cache import SemanticCache
+from embedding_batcher import EmbeddingBatcher
 
 load_dotenv()
 
+# 完全相同的LLM请求（prompt一致）直接复用结果；每条缓存含完整提示词，限制条目数避免内存持续增长
+set_llm_cache(InMemoryCache(maxsize=512))
+
+# 预编译问题解析所用的正则（每次对话都会调用）
+_DATE_FULL = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+_DATE_MD = re.compile(r"(\d{1,2})月(\d{1,2})日")
+_CITY = re.compile(r"([\u4e00-\u9fa9]{2,3})(?:市|州|县|区)(?!\w)")
+_MARKET = re.compile(r"([\u4e00-\u9fa9A-Za-z0-9·（）()\-]{4,}?)(市场|公司|批发市场|交易中心|有限公司)")
+# 指代/追问用语，出现时才需要结合历史对话改写问题
+_REFERENCE = re.compile(r"[它这那其该呢]|同一个|刚才|上面|之前")
+
+
+# 问题解析只依赖问题文本，重复/重试的问题直接命中缓存；返回可哈希的 (键, 值) 元组
+@functools.lru_cache(maxsize=1024)
+def _parse_filters_cached(q: str):
+    # 日期
+    date_full = None
+    date_md = None
+    if m := _DATE_FULL.search(q):
+        date_full = m.group(0)
+    if m := _DATE_MD.search(q):
+        date_md = f"{int(m.group(1)):02d}-{int(m.group(2)):02d}"
+
+    # 省份
+    province = None
+    if m := PROVINCE_PATTERN.search(q):
+        province = m.group(1)
+
+    # 城市（县/区/市）
+    city = None
+    if m := _CITY.search(q):
+        city = m.group(1)
+
+    # 具体市场
+    market = None
+    if m := _MARKET.search(q):
+        market = m.group(0)
+
+    # 品种
+    variety = None
+    for vk in ["大白菜", "白菜", "圆白菜", "洋白菜", "莲花白"]:
+        if vk in q:
+            variety = "大白菜" if vk != "大白菜" else vk
+            break
+
+    return (
+        ("date_full", date_full),
+        ("date_md", date_md),
+        ("province", province),
+        ("city", city),
+        ("market", market),
+        ("variety", variety),
+    )
+
+
+@functools.lru_cache(maxsize=1024)
+def _build_where_cached(filter_items: frozenset):
+    filters = dict(filter_items)
+    clauses = []
+    # 1. 市场 > 省份 > 城市  优先级
+    if filters.get("market"):
+        clauses.append({"market": {"$eq": filters["market"]}})
+    else:
+        if filters.get("province"):
+            clauses.append({"province": {"$eq": filters["province"]}})
+        if filters.get("city"):
+            clauses.append({"city": {"$eq": filters["city"]}})
+
+    # 日期
+    if filters.get("date_full"):
+        clauses.append({"date": {"$eq": filters["date_full"]}})
+    elif filters.get("date_md"):
+        clauses.append({"date_md": {"$eq": filters["date_md"]}})
+
+    # 品种
+    if filters.get("variety"):
+        clauses.append({"variety": {"$eq": filters["variety"]}})
+
+    if not clauses:
+        return {}
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
 
 class VegetablePriceChatbot:
-    def __init__(self):
+    REFERENCE_PATTERN = _REFERENCE
+
+    def __init__(self, csv_path="cabbage_prices.csv"):
         self.api_key = os.getenv("ZHIPUAI_API_KEY")
         if not self.api_key:
             raise ValueError("未找到ZHIPUAI_API_KEY，请在.env文件中配置")
 
-        self.llm = ChatZhipuAI(
-            api_key=self.api_key,
-            model_name="glm-z1-flash",
-            temperature=0.2,
-            request_timeout=60
-        )
+        self.llm = get_chat_llm()
 
         self.db, self.retriever = self._init_retriever()
-        self.memory = ConversationBufferMemory(
+        self._by_key = self._init_exact_index(csv_path)
+        # 仅保留最近 k 轮对话，避免提示词随轮次线性增长
+        self.memory = ConversationBufferWindowMemory(
+            k=6,
             memory_key="chat_history",
             return_messages=True
         )
         self.chain, self.question_answer_chain = self._init_conversational_chain()
+        self.semantic_cache = SemanticCache(threshold=0.92)
+        self.embedding_batcher = EmbeddingBatcher(self.embeddings)
         print("白菜价格查询助手已启动，您可以开始提问了（输入'退出'结束对话）\n")
 
     # ---------------- 检索器初始化 ----------------
     def _init_retriever(self):
-        embeddings = ZhipuAIEmbeddings(api_key=self.api_key, model="embedding-2")
-        db = Chroma(persist_directory="./chroma_db_zhipu", embedding_function=embeddings)
+        self.embeddings = get_embeddings()
+        db = Chroma(persist_directory="./chroma_db_zhipu", embedding_function=self.embeddings)
         n = db._collection.count()
         if n == 0:
             raise ValueError("向量库为空，请先运行 vector_db.py")
         print(f"✅ 向量库加载成功，包含 {n} 条数据")
+        # 过滤检索固定使用该查询语句，其向量只需计算一次
+        self._search_emb = self.embeddings.embed_query("白菜 价格")
         return db, db.as_retriever(search_kwargs={"k": 6})
 
+    # ---------------- 精确查询索引 ----------------
+    # (品种, 市场, 日期) -> 文本；三者齐全时直接查表，无需嵌入与向量检索。
+    # 只保存文本，命中时再构造 Document，避免为每一行常驻元数据与文档对象
+    def _init_exact_index(self, csv_path):
+        by_key: dict[tuple[str, str, str], list[str]] = {}
+        for text, meta in iter_records(csv_path):
+            key = (meta["variety"], meta["market"], meta["date"])
+            by_key.setdefault(key, []).append(text)
+        return by_key
+
     # ---------------- 对话链初始化 ----------------
     def _init_conversational_chain(self):
         contextualize_q_system_prompt = (
@@ -93,76 +197,93 @@ class VegetablePriceChatbot:
 
     # ---------------- 条件解析 ----------------
     def _parse_filters(self, question: str):
-        q = str(question)
-
-        # 日期
-        date_full = None
-        date_md = None
-        if m := re.search(r"(\d{4})-(\d{2})-(\d{2})", q):
-            date_full = m.group(0)
-        if m := re.search(r"(\d{1,2})月(\d{1,2})日", q):
-            date_md = f"{int(m.group(1)):02d}-{int(m.group(2)):02d}"
-
-        # 省份
-        province = next((p for p in
-                         ["北京", "天津", "上海", "重庆", "河北", "山西", "内蒙古", "辽宁", "吉林", "黑龙江",
-                          "江苏", "浙江", "安徽", "福建", "江西", "山东", "河南", "湖北", "湖南", "广东",
-                          "广西", "海南", "四川", "贵州", "云南", "西藏", "陕西", "甘肃", "青海", "宁夏", "新疆"]
-                         if p in q), None)
-
-        # 城市（县/区/市）
-        city = None
-        if m := re.search(r"([\u4e00-\u9fa9]{2,3})(?:市|州|县|区)(?!\w)", q):
-            city = m.group(1)
-
-        # 具体市场
-        market = None
-        if m := re.search(r"([\u4e00-\u9fa9A-Za-z0-9·（）()\-]{4,}?)(市场|公司|批发市场|交易中心|有限公司)", q):
-            market = m.group(0)
-
-        # 品种
-        variety = None
-        for vk in ["大白菜", "白菜", "圆白菜", "洋白菜", "莲花白"]:
-            if vk in q:
-                variety = "大白菜" if vk != "大白菜" else vk
-                break
+        return dict(_parse_filters_cached(str(question)))
+
+    # ---------------- 构造 Chroma 合法 where ----------------
+    # 返回值为缓存中的共享对象，调用方不得修改
+    def _build_where(self, filters: dict):
+        return _build_where_cached(frozenset(filters.items()))
+
+    # ---------------- 检索决策（普通/异步/流式对话共用，不含网络调用） ----------------
+    # 返回 (where, filters_key, docs)：
+    # - docs 非 None：品种、市场、日期齐全，已从精确索引取到结果，无需嵌入与向量检索
+    # - filters_key 非 None：问题需嵌入并查询语义缓存（未解析出条件的问题使用全为 None 的键）；
+    #   依赖上下文的追问（如“那北京的白菜呢？”）既不查也不写缓存
+    def _prepare(self, question):
+        filters = self._parse_filters(question)
+        where = self._build_where(filters)
+        if filters["variety"] and filters["market"] and filters["date_full"]:
+            texts = self._by_key.get((filters["variety"], filters["market"], filters["date_full"]), [])
+            return where, None, [Document(page_content=t) for t in texts[:10]]
+        if self.REFERENCE_PATTERN.search(question):
+            return where, None, None
+        return where, tuple(sorted(filters.items())), None
 
+    # 首轮对话或不含指代的独立问题无需改写，可直接按原问题检索，省去一次问题改写的LLM调用
+    def _needs_rewrite(self, question, chat_history):
+        return bool(chat_history) and bool(self.REFERENCE_PATTERN.search(question))
+
+    # 品种与地点/日期均已明确且不含指代时，问题可独立回答，回答阶段不再附带历史对话以缩短提示词
+    def _is_self_contained(self, question):
+        filters = self._parse_filters(question)
+        resolved = filters["variety"] and (filters["market"] or filters["province"] or filters["date_full"])
+        return bool(resolved) and not self.REFERENCE_PATTERN.search(question)
+
+    def _qa_inputs(self, question, chat_history, docs):
         return {
-            "date_full": date_full,
-            "date_md": date_md,
-            "province": province,
-            "city": city,
-            "market": market,
-            "variety": variety
+            "input": question,
+            "chat_history": [] if self._is_self_contained(question) else chat_history,
+            "context": docs
         }
 
-    # ---------------- 构造 Chroma 合法 where ----------------
-    def _build_where(self, filters: dict):
-        clauses = []
-        # 1. 市场 > 省份 > 城市  优先级
-        if filters.get("market"):
-            clauses.append({"market": {"$eq": filters["market"]}})
-        else:
-            if filters.get("province"):
-                clauses.append({"province": {"$eq": filters["province"]}})
-            if filters.get("city"):
-                clauses.append({"city": {"$eq": filters["city"]}})
-
-        # 日期
-        if filters.get("date_full"):
-            clauses.append({"date": {"$eq": filters["date_full"]}})
-        elif filters.get("date_md"):
-            clauses.append({"date_md": {"$eq": filters["date_md"]}})
-
-        # 品种
-        if filters.get("variety"):
-            clauses.append({"variety": {"$eq": filters["variety"]}})
-
-        if not clauses:
-            return {}
-        if len(clauses) == 1:
-            return clauses[0]
-        return {"$and": clauses}
+    @staticmethod
+    def _response(answer, docs):
+        answer = answer["answer"] if isinstance(answer, dict) and "answer" in answer else answer
+        return {"answer": answer, "sources": [d.page_content for d in docs], "retrieved_count": len(docs)}
+
+    # 记录本轮对话；带有问题向量与缓存键时同时写入语义缓存（记忆与缓存均在内存中，无IO）
+    def _remember(self, question, response, query_emb=None, filters_key=None):
+        self.memory.save_context({"input": question}, {"output": response["answer"]})
+        if query_emb is not None and filters_key is not None:
+            self.semantic_cache.add(query_emb, filters_key, response)
+        return response
+
+    # ---------------- 检索（同步/异步版本仅网络调用不同） ----------------
+    # 返回 (query_emb, filters_key, cached, docs)；cached 非空时表示语义缓存命中
+    def _retrieve(self, question, chat_history):
+        where, filters_key, docs = self._prepare(question)
+        query_emb = None
+        if filters_key is not None:
+            query_emb = self.embeddings.embed_query(question)
+            cached = self.semantic_cache.lookup(query_emb, filters_key)
+            if cached is not None:
+                return query_emb, filters_key, cached, []
+        if docs is None:
+            docs = self.db.similarity_search_by_vector(self._search_emb, k=10, filter=where) if where else []
+        if not docs and not self._needs_rewrite(question, chat_history):
+            # 问题已嵌入过（语义缓存）时复用其向量，避免重复请求嵌入接口；否则按原问题嵌入后检索
+            if query_emb is None:
+                query_emb = self.embeddings.embed_query(question)
+            docs = self.db.similarity_search_by_vector(query_emb, k=6)
+        return query_emb, filters_key, None, docs
+
+    async def _aretrieve(self, question, chat_history):
+        where, filters_key, docs = self._prepare(question)
+        query_emb = None
+        if filters_key is not None:
+            # 并发请求的问题向量经微批合并后统一请求
+            query_emb = await self.embedding_batcher.submit(question)
+            cached = self.semantic_cache.lookup(query_emb, filters_key)
+            if cached is not None:
+                return query_emb, filters_key, cached, []
+        if docs is None:
+            docs = await self.db.asimilarity_search_by_vector(self._search_emb, k=10, filter=where) if where else []
+        if not docs and not self._needs_rewrite(question, chat_history):
+            # 未查语义缓存的问题（如精确索引无结果、无历史的指代问题）同样经微批嵌入
+            if query_emb is None:
+                query_emb = await self.embedding_batcher.submit(question)
+            docs = await self.db.asimilarity_search_by_vector(query_emb, k=6)
+        return query_emb, filters_key, None, docs
 
     # ---------------- 对话入口 ----------------
     def chat(self, question):
@@ -170,28 +291,71 @@ class VegetablePriceChatbot:
             return "对话结束，感谢使用！"
         try:
             chat_history = self.memory.load_memory_variables({})["chat_history"]
-            filters = self._parse_filters(question)
-            where = self._build_where(filters)
-            docs = []
-            if where:
-                docs = self.db.similarity_search(query="白菜 价格", k=10, filter=where)
+            query_emb, filters_key, cached, docs = self._retrieve(question, chat_history)
+            if cached is not None:
+                return self._remember(question, cached)
             if docs:
-                result = self.question_answer_chain.invoke({
-                    "input": question,
-                    "chat_history": chat_history,
-                    "context": docs
-                })
-                answer = result["answer"] if isinstance(result, dict) and "answer" in result else result
-                self.memory.save_context({"input": question}, {"output": answer})
-                return {"answer": answer, "sources": [d.page_content for d in docs], "retrieved_count": len(docs)}
+                answer = self.question_answer_chain.invoke(self._qa_inputs(question, chat_history, docs))
+                return self._remember(question, self._response(answer, docs), query_emb, filters_key)
             # 兜底
             result = self.chain.invoke({"input": question, "chat_history": chat_history})
-            self.memory.save_context({"input": question}, {"output": result["answer"]})
-            return {"answer": result["answer"], "sources": [doc.page_content for doc in result["context"]],
-                    "retrieved_count": len(result["context"])}
+            return self._remember(question, self._response(result["answer"], result["context"]))
         except Exception as e:
             return {"error": str(e)}
 
+    # 异步版本，供 FastAPI 在事件循环内直接等待，不占用线程池
+    async def achat(self, question):
+        if question.lower() in ["退出", "exit", "quit"]:
+            return "对话结束，感谢使用！"
+        try:
+            chat_history = (await self.memory.aload_memory_variables({}))["chat_history"]
+            query_emb, filters_key, cached, docs = await self._aretrieve(question, chat_history)
+            if cached is not None:
+                return self._remember(question, cached)
+            if docs:
+                answer = await self.question_answer_chain.ainvoke(self._qa_inputs(question, chat_history, docs))
+                return self._remember(question, self._response(answer, docs), query_emb, filters_key)
+            # 兜底
+            result = await self.chain.ainvoke({"input": question, "chat_history": chat_history})
+            return self._remember(question, self._response(result["answer"], result["context"]))
+        except Exception as e:
+            return {"error": str(e)}
+
+    # ---------------- 流式对话入口 ----------------
+    # 逐段产出事件：{"context": [...]} 为检索到的数据源，{"answer": "..."} 为回答片段，出错时为 {"error": "..."}
+    async def astream_chat(self, question):
+        if question.lower() in ["退出", "exit", "quit"]:
+            yield {"answer": "对话结束，感谢使用！"}
+            return
+        try:
+            chat_history = (await self.memory.aload_memory_variables({}))["chat_history"]
+            query_emb, filters_key, cached, docs = await self._aretrieve(question, chat_history)
+            if cached is not None:
+                self._remember(question, cached)
+                yield {"context": cached["sources"]}
+                yield {"answer": cached["answer"]}
+                return
+            parts = []
+            if docs:
+                yield {"context": [d.page_content for d in docs]}
+                async for chunk in self.question_answer_chain.astream(self._qa_inputs(question, chat_history, docs)):
+                    parts.append(chunk)
+                    yield {"answer": chunk}
+                self._remember(question, self._response("".join(parts), docs), query_emb, filters_key)
+                return
+            # 兜底
+            context = []
+            async for chunk in self.chain.astream({"input": question, "chat_history": chat_history}):
+                if "context" in chunk:
+                    context = chunk["context"]
+                    yield {"context": [doc.page_content for doc in context]}
+                if "answer" in chunk:
+                    parts.append(chunk["answer"])
+                    yield {"answer": chunk["answer"]}
+            self._remember(question, self._response("".join(parts), context))
+        except Exception as e:
+            yield {"error": str(e)}
+
 
 # -------------------- 启动入口 --------------------
 def main():
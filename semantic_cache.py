@@ -0,0 +1,75 @@
+# semantic_cache.py
+import threading
+import time
+
+import numpy as np
+
+
+class SemanticCache:
+    """
+    语义缓存：按问题向量的余弦相似度命中历史回答，近似改写的问题（如“白菜多少钱”/“白菜价格”）
+    直接复用上次的回答，跳过LLM调用。
+    向量存放在预分配的 (max_entries, dim) 环形缓冲区中，写满后覆盖最早的条目，写入不复制整个矩阵。
+    """
+
+    def __init__(self, threshold: float = 0.92, ttl_seconds: int = 7 * 24 * 3600, max_entries: int = 2048):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._vectors = None  # shape: (max_entries, dim)，已归一化；首次写入时按向量维度分配
+        self._valid = np.zeros(max_entries, dtype=bool)  # 槽位是否存有未过期的条目
+        self._timestamps = np.zeros(max_entries, dtype=np.float64)
+        self._entries = [None] * max_entries  # 与 _vectors 逐行对齐：(filters_key, response)
+        self._next = 0  # 下一个写入位置
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        v = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    # 过期清理（调用方需持有锁）
+    def _expire(self):
+        self._valid &= self._timestamps >= time.time() - self.ttl_seconds
+
+    def lookup(self, embedding, filters_key):
+        v = self._normalize(embedding)
+        with self._lock:
+            self._expire()
+            if self._vectors is not None:
+                scores = self._vectors @ v
+                candidates = np.flatnonzero(self._valid & (scores >= self.threshold))
+                # 相似度从高到低，返回第一个过滤条件一致的条目
+                for i in candidates[np.argsort(-scores[candidates])]:
+                    key, response = self._entries[i]
+                    if key == filters_key:
+                        self.hits += 1
+                        return response
+            self.misses += 1
+            return None
+
+    def add(self, embedding, filters_key, response):
+        v = self._normalize(embedding)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, v.shape[0]), dtype=np.float32)
+            # 写满后覆盖最早写入的条目
+            i = self._next
+            self._vectors[i] = v
+            self._entries[i] = (filters_key, response)
+            self._timestamps[i] = time.time()
+            self._valid[i] = True
+            self._next = (i + 1) % self.max_entries
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": int(self._valid.sum()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -1,27 +1,50 @@
 from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import ZhipuAIEmbeddings
 import os
 import time
+import uuid
+from contextlib import closing
+from itertools import islice
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from data_processor import build_texts_and_metadatas
+from data_processor import iter_records
+from embeddings import EMBEDDING_MODEL, get_embeddings
+from embedding_cache import EmbeddingCache
 
 # 加载环境变量
 load_dotenv()
 
+# 智谱API单次最多64条，留一点余量
+EMBED_BATCH_SIZE = 60
+# 并发请求数，按智谱QPS限额调整
+EMBED_MAX_WORKERS = 8
+# 每轮读取的行数：刚好供所有并发请求各取一批，内存中只保留这一轮的数据
+WINDOW_SIZE = EMBED_BATCH_SIZE * EMBED_MAX_WORKERS
+# 写入 Chroma 的批大小：60 条只是嵌入接口的限制，写入时攒够再一次性提交
+CHROMA_INSERT_BATCH_SIZE = 5000
+
+
+def _is_rate_limited(e: Exception) -> bool:
+    status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    return status == 429 or "429" in str(e)
+
+
+# 调用嵌入接口，仅在触发限流（HTTP 429）时指数退避重试
+def _embed_with_retry(embeddings, texts, max_retries=5):
+    delay = 1.0
+    for attempt in range(max_retries + 1):
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception as e:
+            if attempt == max_retries or not _is_rate_limited(e):
+                raise
+            time.sleep(delay)
+            delay *= 2
+
+
 # 初始化向量存储
-def init_vector_db():
+def init_vector_db(csv_path="cabbage_prices.csv"):
     try:
-        # 加载文本与元数据（不拆分，保证逐行对齐，便于后续元数据过滤）
-        texts, metadatas = build_texts_and_metadatas("cabbage_prices.csv")
-
-        # 验证数据加载是否成功
-        if not texts or not metadatas or len(texts) != len(metadatas):
-            raise ValueError("未加载到有效数据，请检查cabbage_prices.csv文件")
-        
-        total = len(texts)
-        print(f"共需处理 {total} 条数据，将分批次导入向量库...")
-        
         # 获取API密钥
         api_key = os.getenv("ZHIPUAI_API_KEY")
         if not api_key:
@@ -39,44 +62,81 @@ def init_vector_db():
                 print(f"智谱API连接测试失败: {str(e)}")
                 return False
 
-        if not check_zhipu_connection():
-            raise ConnectionError("无法连接到智谱清言API，请检查网络连接")
-
-        # 初始化智谱嵌入模型
-        embeddings = ZhipuAIEmbeddings(
-            api_key=api_key,
-            model="embedding-2"  # 智谱官方推荐的嵌入模型
-        )
-        
-        # 分批次处理（智谱API限制单次最多64条）
-        batch_size = 60  # 留一点余量，避免触发限制
-        total_batches = (total + batch_size - 1) // batch_size
-        db = None
-        
-        for i in range(total_batches):
-            start_idx = i * batch_size
-            end_idx = min((i + 1) * batch_size, total)
-            batch_texts = texts[start_idx:end_idx]
-            batch_metas = metadatas[start_idx:end_idx]
-            
-            print(f"正在处理第 {i+1}/{total_batches} 批次，包含 {len(batch_texts)} 条数据...")
-            
-            # 第一批创建数据库，后续批次添加数据
-            if i == 0:
-                db = Chroma.from_texts(
-                    texts=batch_texts,
-                    embedding=embeddings,
-                    metadatas=batch_metas,
-                    persist_directory="./chroma_db_zhipu"
-                )
-            else:
-                db.add_texts(texts=batch_texts, metadatas=batch_metas)
-            
-            db.persist()
-            # 每批处理后休息1秒，避免请求过于频繁
-            if i < total_batches - 1:
-                time.sleep(1)
-        
+        # 初始化智谱嵌入模型：仅在有文本未命中本地向量缓存、需要请求接口时才检查连接并创建，
+        # 全部命中缓存时重建无需联网
+        embeddings = None
+
+        def require_embeddings():
+            nonlocal embeddings
+            if embeddings is None:
+                if not check_zhipu_connection():
+                    raise ConnectionError("无法连接到智谱清言API，请检查网络连接")
+                embeddings = get_embeddings()
+            return embeddings
+
+        # 写入的向量均已预先计算，无需为 Chroma 指定嵌入函数
+        db = Chroma(persist_directory="./chroma_db_zhipu")
+
+        # 文本与元数据不拆分，保证逐行对齐，便于后续元数据过滤
+        records = iter_records(csv_path)
+        total = 0
+        cached_total = 0
+        insert_batch_size = min(CHROMA_INSERT_BATCH_SIZE, db._client.get_max_batch_size())
+        pending_texts, pending_metas, pending_embs = [], [], []
+
+        # 向量已预先计算，直接写入 Chroma，不再经由其嵌入函数
+        def flush_pending():
+            nonlocal total
+            if not pending_texts:
+                return
+            db._collection.add(
+                ids=[str(uuid.uuid4()) for _ in pending_texts],
+                embeddings=pending_embs,
+                metadatas=pending_metas,
+                documents=pending_texts,
+            )
+            total += len(pending_texts)
+            pending_texts.clear()
+            pending_metas.clear()
+            pending_embs.clear()
+            print(f"已导入 {total} 条数据（其中 {cached_total} 条命中本地向量缓存）...")
+
+        with ThreadPoolExecutor(max_workers=EMBED_MAX_WORKERS) as executor, closing(EmbeddingCache()) as emb_cache:
+            while window := list(islice(records, WINDOW_SIZE)):
+                texts = [text for text, _ in window]
+                metadatas = [meta for _, meta in window]
+
+                # 先查本地向量缓存，只对未命中的文本请求接口
+                hashes = [EmbeddingCache.text_hash(t) for t in texts]
+                window_embeddings = emb_cache.get_many(EMBEDDING_MODEL, hashes)
+                missing = [i for i, vec in enumerate(window_embeddings) if vec is None]
+                cached_total += len(texts) - len(missing)
+
+                if missing:
+                    embeddings = require_embeddings()
+                    miss_texts = [texts[i] for i in missing]
+                    # 分批次并发生成向量（智谱API限制单次最多64条）
+                    batches = [miss_texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(miss_texts), EMBED_BATCH_SIZE)]
+                    results = executor.map(lambda batch: _embed_with_retry(embeddings, batch), batches)
+                    fresh = [vec for batch_vecs in results for vec in batch_vecs]
+                    emb_cache.put_many(EMBEDDING_MODEL, [hashes[i] for i in missing], fresh)
+                    for i, vec in zip(missing, fresh):
+                        window_embeddings[i] = vec
+
+                if len(pending_texts) + len(texts) > insert_batch_size:
+                    flush_pending()
+                pending_texts.extend(texts)
+                pending_metas.extend(metadatas)
+                pending_embs.extend(window_embeddings)
+            flush_pending()
+
+        # 验证数据加载是否成功
+        if total == 0:
+            raise ValueError(f"未加载到有效数据，请检查{csv_path}文件")
+
+        # 全部写入后统一持久化一次
+        db.persist()
+
         print(f"全部数据处理完成，共导入 {total} 条白菜价格数据")
         return db
 